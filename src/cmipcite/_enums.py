@@ -0,0 +1,43 @@
+"""
+Options for the citations
+
+These live in their own module, without any heavy dependencies,
+so that the CLI can use them without importing everything else.
+They are re-exported from [cmipcite.citations][].
+"""
+
+from __future__ import annotations
+
+from cmipcite._compat import StrEnum
+
+
+class AuthorListStyle(StrEnum):
+    """
+    Author list style
+    """
+
+    SHORT = "short"
+    """
+    Short i.e. use "et al."
+    """
+
+    LONG = "long"
+    """
+    Long i.e. list all names
+    """
+
+
+class FormatOption(StrEnum):
+    """
+    Citation format options
+    """
+
+    BIBTEX = "bibtex"
+    """
+    Bibtex format
+    """
+
+    TEXT = "text"
+    """
+    Plain text file
+    """
@@ -0,0 +1,350 @@
+"""
+Caches of the responses from the handle server and DataCite
+
+The handle records of published CMIP data and the metadata of their DOIs
+effectively never change, so caching them on disk means that repeated requests
+for the same citations don't need any network calls.
+Within a single process, values can also be kept in memory
+so that repeated lookups don't even need to go to the disk.
+
+The cache on disk is best-effort: if it can't be used
+(e.g. the database is corrupt or locked, or the cache directory is read-only),
+a warning is emitted and the citations are fetched without it.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import sqlite3
+import time
+import warnings
+from collections import OrderedDict
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import platformdirs
+
+DEFAULT_CACHE_TTL: float = 90 * 24 * 60 * 60
+"""
+Default time (in seconds) after which cached entries are considered stale
+"""
+
+CACHE_FILENAME: str = "cache.sqlite"
+"""
+Name of the cache database within the cache directory
+"""
+
+
+def get_default_cache_path() -> Path:
+    """
+    Get the default path of the cache database
+
+    Returns
+    -------
+    :
+        Path to the cache database in the user's cache directory
+    """
+    return Path(platformdirs.user_cache_dir("cmipcite")) / CACHE_FILENAME
+
+
+class Cache:
+    """
+    Persistent key-value cache backed by SQLite
+
+    Values must be JSON serialisable.
+
+    The database connection is kept open until [close][(c).] is called
+    (or the cache is used as a context manager),
+    so that each lookup doesn't have to open the database again.
+    Within [batch][(c).], values are only written once the block ends
+    (in a single transaction).
+
+    If the database can't be opened, read or written,
+    a warning is emitted and the cache does nothing from then on
+    (i.e. getting a value returns `None` and setting one is a no-op).
+    """
+
+    def __init__(
+        self, path: Path | None = None, ttl: float | None = DEFAULT_CACHE_TTL
+    ) -> None:
+        """
+        Initialise
+
+        Parameters
+        ----------
+        path
+            Path to the cache database.
+
+            If not supplied, we use [get_default_cache_path][(m).].
+
+        ttl
+            Time (in seconds) after which entries are considered stale.
+
+            If `None`, entries never go stale.
+        """
+        if path is None:
+            path = get_default_cache_path()
+
+        self.path = path
+        self.ttl = ttl
+        self.disabled = False
+        self._conn: sqlite3.Connection | None = None
+        # Rows (JSON and time stored) to write at the end of the current batch
+        self._batch: dict[str, tuple[str, float]] | None = None
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._connection() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "stored_at REAL NOT NULL)"
+                )
+        except (sqlite3.Error, OSError) as exc:
+            self._disable(exc)
+
+    def __enter__(self) -> Cache:
+        """
+        Enter the context, in which the cache can be used
+        """
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        """
+        Exit the context, closing the connection to the database
+        """
+        self.close()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Only ever used by one thread at a time,
+            # but not necessarily by the one which created the cache
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            try:
+                # Write-ahead logging, so that committing doesn't need an fsync
+                # (at the risk of losing the last writes on a power cut,
+                # which is fine for a cache)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            except sqlite3.Error:
+                conn.close()
+                raise
+
+            self._conn = conn
+
+        return self._conn
+
+    def _disable(self, exc: sqlite3.Error | OSError) -> None:
+        self.disabled = True
+        self.close()
+        warnings.warn(
+            f"Not using the cache at {self.path}, it can't be used: {exc}",
+            stacklevel=3,
+        )
+
+    def close(self) -> None:
+        """
+        Close the connection to the database
+
+        The cache can still be used afterwards, it then connects again.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @contextlib.contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Collect the values set within the block and write them once it ends
+
+        This saves committing a transaction for each value,
+        e.g. while many requests are in flight.
+        Values set within the block can already be got from the cache.
+        Nested batches are written when the outermost one ends.
+        """
+        if self._batch is not None:
+            yield
+            return
+
+        self._batch = {}
+        try:
+            yield
+        finally:
+            rows, self._batch = self._batch, None
+            self._write(rows)
+
+    def get(self, key: str, allow_stale: bool = False) -> Any | None:
+        """
+        Get a value from the cache
+
+        Parameters
+        ----------
+        key
+            Key of the value
+
+        allow_stale
+            Whether to also return values which are older than the cache's TTL.
+
+            This is useful e.g. to revalidate stale values with the server
+            rather than fetching them again from scratch.
+
+        Returns
+        -------
+        :
+            Cached value or `None` if there is no (fresh) value for `key`
+        """
+        if self.disabled:
+            return None
+
+        if self._batch is not None and key in self._batch:
+            row: tuple[str, float] | None = self._batch[key]
+        else:
+            try:
+                row = (
+                    self._connection()
+                    .execute("SELECT value, stored_at FROM cache WHERE key = ?", (key,))
+                    .fetchone()
+                )
+            except (sqlite3.Error, OSError) as exc:
+                self._disable(exc)
+                return None
+
+        if row is None:
+            return None
+
+        value, stored_at = row
+        try:
+            if (
+                not allow_stale
+                and self.ttl is not None
+                and time.time() - stored_at > self.ttl
+            ):
+                return None
+
+            return json.loads(value)
+        except (TypeError, ValueError):
+            # A damaged entry, treat it as missing so it is fetched (and set) again
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Set a value in the cache
+
+        Parameters
+        ----------
+        key
+            Key of the value
+
+        value
+            Value to store
+        """
+        if self.disabled:
+            return
+
+        row = (json.dumps(value), time.time())
+        if self._batch is not None:
+            self._batch[key] = row
+        else:
+            self._write({key: row})
+
+    def _write(self, rows: dict[str, tuple[str, float]]) -> None:
+        if self.disabled or not rows:
+            return
+
+        try:
+            with self._connection() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cache (key, value, stored_at) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (key, value, stored_at)
+                        for key, (value, stored_at) in rows.items()
+                    ],
+                )
+        except (sqlite3.Error, OSError) as exc:
+            self._disable(exc)
+
+    def clear(self) -> None:
+        """
+        Remove all values from the cache
+        """
+        if self._batch is not None:
+            self._batch.clear()
+
+        if self.disabled:
+            return
+
+        try:
+            with self._connection() as conn:
+                conn.execute("DELETE FROM cache")
+        except (sqlite3.Error, OSError) as exc:
+            self._disable(exc)
+
+
+class MemoryCache:
+    """
+    In-memory key-value cache which keeps the most recently used values
+
+    Useful for values which are looked up repeatedly within a single process
+    (e.g. when getting citations in a loop in a notebook).
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        """
+        Initialise
+
+        Parameters
+        ----------
+        maxsize
+            Maximum number of values to keep
+        """
+        self.maxsize = maxsize
+        self._values: OrderedDict[str, Any] = OrderedDict()
+
+    def get(self, key: str) -> Any | None:
+        """
+        Get a value from the cache
+
+        Parameters
+        ----------
+        key
+            Key of the value
+
+        Returns
+        -------
+        :
+            Cached value or `None` if there is no value for `key`
+        """
+        if key not in self._values:
+            return None
+
+        self._values.move_to_end(key)
+
+        return self._values[key]
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Set a value in the cache
+
+        If the cache is full, the least recently used value is dropped.
+
+        Parameters
+        ----------
+        key
+            Key of the value
+
+        value
+            Value to store
+        """
+        self._values[key] = value
+        self._values.move_to_end(key)
+        if len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Remove all values from the cache
+        """
+        self._values.clear()
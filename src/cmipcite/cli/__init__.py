@@ -4,13 +4,14 @@ Command-line interface
 
 # # Do not use this here, it breaks typer's annotations
 # from __future__ import annotations
+import sys
 from pathlib import Path
 from typing import Annotated, Optional, Union
 
 import typer
 
 import cmipcite
-from cmipcite.citations import AuthorListStyle, FormatOption, get_citations
+from cmipcite._enums import AuthorListStyle, FormatOption
 
 app = typer.Typer()
 
@@ -42,11 +43,14 @@ def cli(
 
 
 @app.command(name="get")
-def get(
+def get(  # noqa: PLR0913
     in_values: Annotated[
         list[str],
         typer.Argument(
-            help="Tracking IDs, PIDs or file paths for which to generate citations"
+            help=(
+                "Tracking IDs, PIDs, DOIs or file paths "
+                "for which to generate citations"
+            )
         ),
     ],
     out_path: Annotated[
@@ -65,23 +69,45 @@ def get(
             help="Whether the author list should be long (all names) or short (et al.)"
         ),
     ] = AuthorListStyle.LONG,
+    use_cache: Annotated[
+        bool,
+        typer.Option(
+            "--cache/--no-cache",
+            help="Whether to use the cache of the responses from the servers",
+        ),
+    ] = True,
+    cache_dir: Annotated[
+        Union[Path, None],
+        typer.Option(
+            help=(
+                "Directory in which to keep the cache. "
+                "If not provided, the user's cache directory is used."
+            )
+        ),
+    ] = None,
 ) -> None:
     """
-    Generate citations from CMIP files or tracking IDs or PIDs
+    Generate citations from CMIP files, tracking IDs, PIDs or DOIs
     """
+    # Imported here so that e.g. `--help` and `--version` stay fast
+    from cmipcite.citations import get_citations
+
     citations = get_citations(
         ids_or_paths=in_values,
         format=format,
         author_list_style=author_list_style,
+        use_cache=use_cache,
+        cache_dir=cache_dir,
     )
 
-    text = "\n\n".join(citations)
+    text = "\n\n".join(citations).encode("utf-8")
 
     if out_path is None:
-        print(text)
+        # Straight to the underlying buffer, as a single write
+        sys.stdout.buffer.write(text + b"\n")
+        sys.stdout.buffer.flush()
     else:
-        with open(out_path, "w") as fh:
-            fh.write(text)
+        out_path.write_bytes(text)
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,216 @@
+"""
+Throttling of the requests made to the handle server, DataCite and doi.org
+
+When citations are requested for many IDs at once,
+firing all the requests at the same moment risks tripping the servers' rate limits.
+The transport defined here bounds the number of requests in flight,
+limits the rate at which they are sent and retries requests
+which were rejected because the server was overloaded.
+The limits apply to each server separately,
+so e.g. a backlog of DataCite requests doesn't hold up those to the handle server.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+import httpx
+
+RETRY_STATUS_CODES: frozenset[int] = frozenset({429, 500, 502, 503, 504})
+"""
+Status codes of responses for which the request is retried
+"""
+
+
+def check_limits(max_concurrent: int, max_per_second: float) -> None:
+    """
+    Check that the limits on the requests allow any requests at all
+
+    Parameters
+    ----------
+    max_concurrent
+        Maximum number of requests in flight at once to each host
+
+    max_per_second
+        Maximum number of requests to send per second to each host
+
+    Raises
+    ------
+    ValueError
+        `max_concurrent` or `max_per_second` is not positive
+    """
+    if max_concurrent < 1:
+        msg = f"max_concurrent must be at least 1, received {max_concurrent}"
+        raise ValueError(msg)
+
+    if max_per_second <= 0:
+        msg = f"max_per_second must be positive, received {max_per_second}"
+        raise ValueError(msg)
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter
+
+    Bursts of up to `max_per_second` acquisitions (but at least one)
+    happen immediately,
+    after which acquisitions are spread out to `max_per_second` on average.
+    """
+
+    def __init__(self, max_per_second: float) -> None:
+        """
+        Initialise
+
+        Parameters
+        ----------
+        max_per_second
+            Maximum number of acquisitions per second
+        """
+        self.max_per_second = max_per_second
+        # Below one acquisition per second, the bucket must still hold a whole token
+        self._capacity = max(1.0, max_per_second)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        """
+        Wait until the rate limit allows another acquisition
+        """
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity,
+                self._tokens + (now - self._updated) * self.max_per_second,
+            )
+            self._updated = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self._tokens) / self.max_per_second)
+
+
+class ThrottledTransport(httpx.AsyncBaseTransport):
+    """
+    Transport which throttles and retries the requests sent via another transport
+
+    The requests to each host are throttled independently.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        transport: httpx.AsyncBaseTransport,
+        max_concurrent: int = 10,
+        max_per_second: float = 10.0,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_retry_after: float = 60.0,
+    ) -> None:
+        """
+        Initialise
+
+        Parameters
+        ----------
+        transport
+            Transport via which to send the requests
+
+        max_concurrent
+            Maximum number of requests in flight at once to each host
+
+        max_per_second
+            Maximum number of requests to send per second to each host
+
+        max_retries
+            Maximum number of times to retry a request
+            whose response has a status code in [RETRY_STATUS_CODES][(m).]
+
+        backoff_factor
+            Factor (in seconds) controlling the exponential backoff between retries.
+
+            The n-th retry waits `backoff_factor * 2 ** (n - 1)` seconds,
+            unless the server asks for a specific wait via a `Retry-After` header.
+
+        max_retry_after
+            Longest wait (in seconds) asked for via a `Retry-After` header
+            for which we retry the request.
+
+            If the server asks us to wait longer, its response is returned instead.
+
+        Raises
+        ------
+        ValueError
+            `max_concurrent` or `max_per_second` is not positive
+        """
+        check_limits(max_concurrent=max_concurrent, max_per_second=max_per_second)
+
+        self.transport = transport
+        self.max_concurrent = max_concurrent
+        self.max_per_second = max_per_second
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_retry_after = max_retry_after
+        # Created lazily per host, so the semaphores belong to the loop which uses them
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._rate_limiters: dict[str, RateLimiter] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """
+        Send a request, respecting the limits and retrying if needed
+
+        Parameters
+        ----------
+        request
+            Request to send
+
+        Returns
+        -------
+        :
+            Response to the request
+        """
+        host = request.url.host
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.max_concurrent)
+            self._rate_limiters[host] = RateLimiter(self.max_per_second)
+
+        semaphore = self._semaphores[host]
+        rate_limiter = self._rate_limiters[host]
+
+        attempt = 0
+        while True:
+            async with semaphore:
+                await rate_limiter.acquire()
+                response = await self.transport.handle_async_request(request)
+
+            if (
+                response.status_code not in RETRY_STATUS_CODES
+                or attempt >= self.max_retries
+            ):
+                return response
+
+            delay = self._get_retry_delay(response, attempt)
+            if delay > self.max_retry_after:
+                # Rather than block for e.g. an hour, let the caller see the error
+                return response
+
+            await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _get_retry_delay(self, response: httpx.Response, attempt: int) -> float:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                # An HTTP date rather than a number of seconds, use our backoff
+                pass
+
+        return float(self.backoff_factor * 2**attempt)
+
+    async def aclose(self) -> None:
+        """
+        Close the underlying transport
+        """
+        await self.transport.aclose()
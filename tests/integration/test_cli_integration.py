@@ -4,9 +4,15 @@ Integration tests of the CLI
 
 from __future__ import annotations
 
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
 from typer.testing import CliRunner
 
 import cmipcite
+import cmipcite.citations
 from cmipcite.cli import app
 
 runner = CliRunner()
@@ -17,3 +23,72 @@ def test_version():
 
     assert result.exit_code == 0, result.exc_info
     assert result.stdout == f"cmipcite {cmipcite.__version__}\n"
+
+
+@pytest.fixture
+def get_citations_calls(monkeypatch):
+    calls = []
+
+    def get_citations(**kwargs):
+        calls.append(kwargs)
+        return ["Citation one", "Citation two (ünïcode)"]
+
+    # Imported by the CLI when it is needed, so patch it where it is defined
+    monkeypatch.setattr(cmipcite.citations, "get_citations", get_citations)
+
+    return calls
+
+
+@pytest.mark.parametrize(
+    "args, exp_use_cache, exp_cache_dir",
+    (
+        pytest.param([], True, None, id="default"),
+        pytest.param(["--no-cache"], False, None, id="no-cache"),
+        pytest.param(["--cache-dir", "cache"], True, Path("cache"), id="cache-dir"),
+    ),
+)
+def test_get_cache_options(get_citations_calls, args, exp_use_cache, exp_cache_dir):
+    result = runner.invoke(app, ["get", "hdl:21.14100/abc", *args])
+
+    assert result.exit_code == 0, result.exc_info
+    assert len(get_citations_calls) == 1
+    assert get_citations_calls[0]["ids_or_paths"] == ["hdl:21.14100/abc"]
+    assert get_citations_calls[0]["use_cache"] is exp_use_cache
+    assert get_citations_calls[0]["cache_dir"] == exp_cache_dir
+
+
+def test_get_stdout(get_citations_calls):
+    result = runner.invoke(app, ["get", "hdl:21.14100/abc"])
+
+    assert result.exit_code == 0, result.exc_info
+    assert result.stdout_bytes == "Citation one\n\nCitation two (ünïcode)\n".encode()
+
+
+def test_get_out_path(get_citations_calls, tmp_path):
+    out_path = tmp_path / "citations.txt"
+
+    result = runner.invoke(
+        app, ["get", "hdl:21.14100/abc", "--out-path", str(out_path)]
+    )
+
+    assert result.exit_code == 0, result.exc_info
+    assert result.stdout_bytes == b""
+    assert out_path.read_bytes() == "Citation one\n\nCitation two (ünïcode)".encode()
+
+
+def test_citation_machinery_imported_lazily():
+    # In a fresh interpreter, as the tests have imported everything already
+    res = subprocess.run(  # noqa: S603
+        [
+            sys.executable,
+            "-c",
+            "import sys, cmipcite.cli; "
+            "print(sorted({'httpx', 'cmipcite.citations'} & set(sys.modules)))",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    # Otherwise e.g. `--help` and `--version` pay for importing them
+    assert res.stdout.strip() == "[]"
@@ -26,6 +26,8 @@ def test_citations_args(
     out_path, out_format, author_list_style, file_regression, tmpdir
 ):
     args = ["get", "hdl:21.14100/f2f502c9-9626-31c6-b016-3f7c0534803b"]
+    # Don't read (possibly stale) responses from, or write to, the user's cache
+    args.extend(["--cache-dir", str(tmpdir)])
 
     if out_path is not None:
         out_path_full = Path(tmpdir) / out_path
@@ -66,6 +68,7 @@ def test_citations_args(
 )
 def test_types_of_id(input_id, file_regression, tmpdir):
     args = ["get", input_id]
+    args.extend(["--cache-dir", str(tmpdir)])
     args.extend(["--author-list-style", "short"])
 
     result = runner.invoke(app, args)
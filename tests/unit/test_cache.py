@@ -0,0 +1,162 @@
+"""
+Tests of `cmipcite.cache`
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import time
+
+import pytest
+
+from cmipcite.cache import Cache, MemoryCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with Cache(tmp_path / "cache.sqlite") as cache:
+        yield cache
+
+
+def test_get_missing(cache):
+    assert cache.get("handle:21.14100/abc") is None
+
+
+@pytest.mark.parametrize(
+    "value",
+    (
+        pytest.param("doi:10.22033/ESGF/CMIP6.6595", id="str"),
+        pytest.param({"creators": [{"name": "Wieners, Karl"}]}, id="dict"),
+    ),
+)
+def test_set_get(cache, value):
+    cache.set("key", value)
+
+    assert cache.get("key") == value
+
+
+def test_persistent(tmp_path):
+    Cache(tmp_path / "cache.sqlite").set("key", "value")
+
+    assert Cache(tmp_path / "cache.sqlite").get("key") == "value"
+
+
+def test_batch(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    with Cache(path) as cache, cache.batch():
+        cache.set("key", "value")
+        with cache.batch():
+            cache.set("other", "value")
+
+        # Available straight away, but only written at the end of the batch
+        assert cache.get("key") == "value"
+        assert Cache(path).get("other") is None
+
+    assert Cache(path).get("key") == "value"
+    assert Cache(path).get("other") == "value"
+
+
+def test_ttl(tmp_path, monkeypatch):
+    cache = Cache(tmp_path / "cache.sqlite", ttl=10.0)
+    cache.set("key", "value")
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 20.0)
+
+    assert cache.get("key") is None
+    assert Cache(tmp_path / "cache.sqlite", ttl=None).get("key") == "value"
+    assert cache.get("key", allow_stale=True) == "value"
+
+
+def test_clear(cache):
+    cache.set("key", "value")
+    cache.clear()
+
+    assert cache.get("key") is None
+
+
+def test_corrupt(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    path.write_bytes(b"not a database" * 100)
+
+    with pytest.warns(UserWarning, match="Not using the cache"):
+        cache = Cache(path)
+
+    # Carries on without caching (and without warning again)
+    cache.set("key", "value")
+    assert cache.get("key") is None
+    assert cache.disabled
+
+
+def test_directory_not_creatable(tmp_path):
+    (tmp_path / "cmipcite").write_text("not a directory")
+
+    with pytest.warns(UserWarning, match="Not using the cache"):
+        cache = Cache(tmp_path / "cmipcite" / "cache.sqlite")
+
+    assert cache.get("key") is None
+
+
+def test_write_fails(cache, monkeypatch):
+    def connect(*args, **kwargs):
+        msg = "database is locked"
+        raise sqlite3.OperationalError(msg)
+
+    # So that the cache has to connect again to write
+    cache.close()
+    monkeypatch.setattr(sqlite3, "connect", connect)
+
+    with pytest.warns(UserWarning, match="database is locked"):
+        cache.set("key", "value")
+
+    assert cache.disabled
+
+
+def test_clear_fails(cache, monkeypatch):
+    def connect(*args, **kwargs):
+        msg = "database is locked"
+        raise sqlite3.OperationalError(msg)
+
+    cache.close()
+    monkeypatch.setattr(sqlite3, "connect", connect)
+
+    with pytest.warns(UserWarning, match="database is locked"):
+        cache.clear()
+
+    assert cache.disabled
+    # Nothing more to do (or warn about) once disabled
+    cache.clear()
+
+
+@pytest.mark.parametrize(
+    "value, stored_at",
+    (
+        pytest.param("{not json", time.time(), id="value"),
+        pytest.param('"value"', "not a time", id="stored_at"),
+    ),
+)
+def test_damaged_entry(cache, value, stored_at):
+    with cache._connection() as conn:
+        conn.execute(
+            "INSERT INTO cache (key, value, stored_at) VALUES (?, ?, ?)",
+            ("key", value, stored_at),
+        )
+
+    assert cache.get("key") is None
+
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+
+
+def test_memory_cache_drops_least_recently_used():
+    cache = MemoryCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Using "a" makes "b" the least recently used
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
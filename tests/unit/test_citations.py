@@ -0,0 +1,933 @@
+"""
+Tests of `cmipcite.citations`
+
+The handle server, DataCite and doi.org are replaced with a mock transport,
+so these tests don't need network access.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import re
+import time
+from collections import Counter
+
+import httpx
+import pytest
+
+import cmipcite.citations
+from cmipcite.cache import Cache
+from cmipcite.citations import (
+    AuthorListStyle,
+    FormatOption,
+    get_citations_async,
+)
+
+HANDLES = {
+    "21.14100/dataset-mpi": {
+        "AGGREGATION_LEVEL": "DATASET",
+        "IS_PART_OF": "doi:10.22033/ESGF/CMIP6.6595",
+        "VERSION_NUMBER": "20211412",
+    },
+    "21.14100/dataset-mpi-v2": {
+        "AGGREGATION_LEVEL": "DATASET",
+        "IS_PART_OF": "doi:10.22033/ESGF/CMIP6.6595",
+        "VERSION_NUMBER": "20230101",
+    },
+    "21.14100/dataset-ec-earth": {
+        "AGGREGATION_LEVEL": "DATASET",
+        "IS_PART_OF": "doi:10.22033/ESGF/CMIP6.4700",
+        "VERSION_NUMBER": "20200412",
+    },
+    "21.14100/file-mpi-1": {
+        "AGGREGATION_LEVEL": "FILE",
+        "IS_PART_OF": "hdl:21.14100/dataset-mpi",
+    },
+    "21.14100/file-mpi-2": {
+        "AGGREGATION_LEVEL": "FILE",
+        "IS_PART_OF": "hdl:21.14100/dataset-mpi",
+    },
+}
+
+DATACITE = {
+    "10.22033/esgf/cmip6.6595": {
+        "doi": "10.22033/esgf/cmip6.6595",
+        "creators": [
+            {"name": "Wieners, Karl-Hermann", "familyName": "Wieners"},
+            {"name": "Giorgetta, Marco", "familyName": "Giorgetta"},
+        ],
+        "publicationYear": 2019,
+        "titles": [{"title": "MPI-M MPI-ESM1.2-LR model output"}],
+        "publisher": "Earth System Grid Federation",
+        "descriptions": [{"description": "Not needed for citations"}],
+    },
+    "10.22033/esgf/cmip6.4700": {
+        "doi": "10.22033/esgf/cmip6.4700",
+        "creators": [{"name": "EC-Earth Consortium (EC-Earth)"}],
+        "publicationYear": 2019,
+        "titles": [{"title": "EC-Earth-Consortium EC-Earth3 model output"}],
+        "publisher": "Earth System Grid Federation",
+    },
+}
+
+
+class MockServers:
+    """
+    Mock of the handle server, DataCite and doi.org
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency
+        # Reproducible, but different for each request
+        self.jitter = jitter
+        self.random = random.Random(0)  # noqa: S311
+        self.requests = Counter()
+        self.not_modified = Counter()
+        self.in_flight = Counter()
+        self.max_in_flight = Counter()
+        self.events = []
+        self.bibtex_title_template = "title = {{{title}}}"
+        self.datacite_max_page_size = 1000
+
+    async def __call__(self, request):
+        host = request.url.host
+        self.requests[host] += 1
+        self.in_flight[host] += 1
+        self.max_in_flight[host] = max(self.max_in_flight[host], self.in_flight[host])
+        self.events.append(("start", host))
+        try:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+            return self.respond(request)
+        finally:
+            self.in_flight[host] -= 1
+            self.events.append(("end", host))
+
+    def respond(self, request):
+        if request.url.host == "hdl.handle.net":
+            return self.respond_handle(request)
+
+        if request.url.host == "api.datacite.org" and request.url.path == "/dois":
+            return self.respond_datacite_query(request)
+
+        if request.url.host == "api.datacite.org":
+            return self.respond_datacite(request)
+
+        if request.url.host == "dx.doi.org":
+            return self.respond_bibtex(request)
+
+        raise NotImplementedError(request.url)
+
+    def respond_handle(self, request):
+        handle = request.url.path.removeprefix("/api/handles/")
+        if handle not in HANDLES:
+            return httpx.Response(404, json={"responseCode": 100})
+
+        values = [
+            {"index": i, "type": k, "data": {"format": "string", "value": v}}
+            for i, (k, v) in enumerate(HANDLES[handle].items(), start=1)
+        ]
+        return httpx.Response(
+            200, json={"responseCode": 1, "handle": handle, "values": values}
+        )
+
+    def respond_datacite_query(self, request):
+        dois = re.findall(r'"(.*?)"', request.url.params["query"])
+        data = [
+            {"id": doi.lower(), "attributes": self.datacite_attributes(request, doi)}
+            for doi in dois
+            if doi.lower() in DATACITE
+        ]
+        page_size = min(
+            int(request.url.params["page[size]"]), self.datacite_max_page_size
+        )
+        page = int(request.url.params.get("page[number]", 1))
+        body = {"data": data[(page - 1) * page_size : page * page_size]}
+        if page * page_size < len(data):
+            next_page = request.url.copy_set_param("page[number]", page + 1)
+            body["links"] = {"next": str(next_page)}
+
+        return httpx.Response(200, json=body)
+
+    def respond_datacite(self, request):
+        doi = request.url.path.removeprefix("/dois/").lower()
+        if doi not in DATACITE:
+            return httpx.Response(404, json={"errors": [{"status": "404"}]})
+
+        if (not_modified := self.check_etag(request, doi)) is not None:
+            return not_modified
+
+        attributes = self.datacite_attributes(request, doi)
+        return httpx.Response(
+            200,
+            json={"data": {"id": doi, "attributes": attributes}},
+            headers={"etag": f'"{doi}"'},
+        )
+
+    def respond_bibtex(self, request):
+        doi = request.url.path.removeprefix("/")
+        if (not_modified := self.check_etag(request, doi)) is not None:
+            return not_modified
+
+        title = self.bibtex_title_template.format(
+            title=DATACITE[doi.lower()]["titles"][0]["title"]
+        )
+        return httpx.Response(
+            200,
+            text=f"@misc{{{doi},\n  doi = {{{doi}}},\n  {title}\n}}",
+            headers={"etag": f'"{doi}"'},
+        )
+
+    def check_etag(self, request, doi):
+        if request.headers.get("if-none-match") == f'"{doi}"':
+            self.not_modified[request.url.host] += 1
+            return httpx.Response(304)
+
+        return None
+
+    def datacite_attributes(self, request, doi):
+        attributes = DATACITE[doi.lower()]
+        if "fields[dois]" not in request.url.params:
+            return attributes
+
+        # Sparse fieldset
+        fields = request.url.params["fields[dois]"].split(",")
+        return {k: v for k, v in attributes.items() if k in fields}
+
+
+@pytest.fixture
+def servers():
+    return MockServers()
+
+
+@pytest.fixture(autouse=True)
+def clear_memory_caches():
+    # Otherwise the requests made by each test depend on the tests run before it
+    cmipcite.citations._HANDLE_RECORDS.clear()
+    cmipcite.citations._DOI_VERSIONS.clear()
+
+
+def get_citations(servers, ids, **kwargs):
+    kwargs.setdefault("use_cache", False)
+
+    async def run():
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(servers), follow_redirects=True
+        ) as client:
+            return await get_citations_async(ids, client=client, **kwargs)
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "input_id",
+    (
+        pytest.param("hdl:21.14100/dataset-mpi", id="pid"),
+        pytest.param("21.14100/dataset-mpi", id="pid-no-prefix"),
+        pytest.param("hdl:21.14100/file-mpi-1", id="tracking"),
+    ),
+)
+@pytest.mark.parametrize(
+    "author_list_style, exp",
+    (
+        pytest.param(
+            AuthorListStyle.SHORT,
+            "Wieners et al. (2019): MPI-M MPI-ESM1.2-LR model output. "
+            "Version 20211412. Earth System Grid Federation. "
+            "https://doi.org/10.22033/ESGF/CMIP6.6595.",
+            id="short",
+        ),
+        pytest.param(
+            AuthorListStyle.LONG,
+            "Wieners, Karl-Hermann; Giorgetta, Marco (2019): "
+            "MPI-M MPI-ESM1.2-LR model output. "
+            "Version 20211412. Earth System Grid Federation. "
+            "https://doi.org/10.22033/ESGF/CMIP6.6595.",
+            id="long",
+        ),
+    ),
+)
+def test_text(servers, input_id, author_list_style, exp):
+    res = get_citations(
+        servers,
+        [input_id],
+        format=FormatOption.TEXT,
+        author_list_style=author_list_style,
+    )
+
+    assert res == [exp]
+
+
+def test_text_single_creator(servers):
+    res = get_citations(
+        servers,
+        ["hdl:21.14100/dataset-ec-earth"],
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    assert res == [
+        "EC-Earth Consortium (EC-Earth) (2019): "
+        "EC-Earth-Consortium EC-Earth3 model output. "
+        "Version 20200412. Earth System Grid Federation. "
+        "https://doi.org/10.22033/ESGF/CMIP6.4700."
+    ]
+
+
+@pytest.mark.parametrize(
+    "bibtex_title_template, exp_title",
+    (
+        pytest.param(
+            "title = {{{title}}}",
+            "MPI-M MPI-ESM1.2-LR model output",
+            id="spaces",
+        ),
+        pytest.param(
+            "title={{{title}}}",
+            "MPI-M MPI-ESM1.2-LR model output",
+            id="no-spaces",
+        ),
+        pytest.param(
+            "title = {{MPI-M MPI-ESM1.2-LR\n  model output}}",
+            "MPI-M MPI-ESM1.2-LR\n  model output",
+            id="multiline",
+        ),
+        pytest.param(
+            "title={{MPI-M MPI-ESM1.2-LR\n  model output}}",
+            "MPI-M MPI-ESM1.2-LR\n  model output",
+            id="no-spaces-multiline",
+        ),
+        pytest.param(
+            "title = {{{{MPI-M}} MPI-ESM1.2-LR {{model}} output}}",
+            "{MPI-M} MPI-ESM1.2-LR {model} output",
+            id="nested-braces",
+        ),
+    ),
+)
+def test_bibtex(servers, bibtex_title_template, exp_title):
+    servers.bibtex_title_template = bibtex_title_template
+
+    res = get_citations(
+        servers,
+        ["hdl:21.14100/file-mpi-1"],
+        format=FormatOption.BIBTEX,
+        author_list_style=AuthorListStyle.LONG,
+    )
+
+    assert res == [
+        "@misc{10.22033/ESGF/CMIP6.6595,\n"
+        "  doi = {10.22033/ESGF/CMIP6.6595},\n"
+        f"  title = {{{exp_title}. Version 20211412.}}\n"
+        "}"
+    ]
+
+
+@pytest.mark.parametrize(
+    "input_id",
+    (
+        pytest.param("doi:10.22033/ESGF/CMIP6.6595", id="prefix"),
+        pytest.param("DOI:10.22033/ESGF/CMIP6.6595", id="prefix-upper-case"),
+        pytest.param("10.22033/ESGF/CMIP6.6595", id="no-prefix"),
+    ),
+)
+@pytest.mark.parametrize(
+    "format, exp",
+    (
+        pytest.param(
+            FormatOption.TEXT,
+            "Wieners et al. (2019): MPI-M MPI-ESM1.2-LR model output. "
+            "Earth System Grid Federation. "
+            "https://doi.org/10.22033/ESGF/CMIP6.6595.",
+            id="text",
+        ),
+        pytest.param(
+            FormatOption.BIBTEX,
+            "@misc{10.22033/ESGF/CMIP6.6595,\n"
+            "  doi = {10.22033/ESGF/CMIP6.6595},\n"
+            "  title = {MPI-M MPI-ESM1.2-LR model output}\n"
+            "}",
+            id="bibtex",
+        ),
+    ),
+)
+def test_doi_input(servers, input_id, format, exp):
+    res = get_citations(
+        servers,
+        [input_id],
+        format=format,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    # No version, as a DOI covers all versions of its datasets
+    assert res == [exp]
+    assert servers.requests["hdl.handle.net"] == 0
+
+
+def test_multiple_inputs(servers):
+    res = get_citations(
+        servers,
+        [
+            "hdl:21.14100/file-mpi-1",
+            "hdl:21.14100/dataset-ec-earth",
+            "hdl:21.14100/file-mpi-2",
+            "hdl:21.14100/dataset-mpi",
+        ],
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    # One citation per dataset, in order of first appearance
+    assert [c.split(" (2019)")[0] for c in res] == [
+        "Wieners et al.",
+        "EC-Earth Consortium (EC-Earth)",
+    ]
+    # Each DOI's metadata is only requested once
+    # (here, the datasets are resolved at the same time so in a single batch)
+    assert servers.requests["api.datacite.org"] == 1
+
+
+@pytest.mark.parametrize(
+    "ids, exp_handle_requests",
+    (
+        pytest.param(["hdl:21.14100/dataset-mpi"], 1, id="pid"),
+        pytest.param(["hdl:21.14100/file-mpi-1"], 2, id="tracking"),
+        pytest.param(
+            ["hdl:21.14100/file-mpi-1", "hdl:21.14100/file-mpi-2"],
+            3,
+            id="trackings-same-dataset",
+        ),
+        pytest.param(
+            ["hdl:21.14100/file-mpi-1", "hdl:21.14100/dataset-mpi"],
+            2,
+            id="tracking-and-its-pid",
+        ),
+        pytest.param(
+            ["hdl:21.14100/file-mpi-1", "hdl:21.14100/file-mpi-1"],
+            2,
+            id="duplicate-tracking",
+        ),
+    ),
+)
+def test_handle_requests(servers, ids, exp_handle_requests):
+    get_citations(
+        servers,
+        ids,
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    assert servers.requests["hdl.handle.net"] == exp_handle_requests
+
+
+def test_doi_and_version_memoized(servers):
+    for _ in range(2):
+        get_citations(
+            servers,
+            ["hdl:21.14100/file-mpi-1"],
+            format=FormatOption.TEXT,
+            author_list_style=AuthorListStyle.SHORT,
+        )
+
+    # The second call doesn't need to resolve the tracking ID again
+    assert servers.requests["hdl.handle.net"] == 2
+
+
+def test_handle_records_memoized(servers):
+    for input_id in ["hdl:21.14100/file-mpi-1", "hdl:21.14100/file-mpi-2"]:
+        get_citations(
+            servers,
+            [input_id],
+            format=FormatOption.TEXT,
+            author_list_style=AuthorListStyle.SHORT,
+        )
+
+    # The record of the dataset is only fetched the first time
+    assert servers.requests["hdl.handle.net"] == 3
+
+
+@pytest.mark.parametrize("format", (FormatOption.TEXT, FormatOption.BIBTEX))
+def test_cache_dir(servers, tmp_path, format):
+    res = []
+    requests = []
+    for _ in range(2):
+        cmipcite.citations._HANDLE_RECORDS.clear()
+        cmipcite.citations._DOI_VERSIONS.clear()
+        res.append(
+            get_citations(
+                servers,
+                ["hdl:21.14100/file-mpi-1", "hdl:21.14100/dataset-ec-earth"],
+                format=format,
+                author_list_style=AuthorListStyle.SHORT,
+                use_cache=True,
+                cache_dir=tmp_path,
+            )
+        )
+        requests.append(sum(servers.requests.values()))
+
+    assert (tmp_path / "cache.sqlite").exists()
+    assert res[0] == res[1]
+    # The second time around, everything comes from the cache
+    assert requests[0] > 0
+    assert requests[1] == requests[0]
+
+
+def test_cache_dir_unusable(servers, tmp_path):
+    (tmp_path / "cache.sqlite").write_bytes(b"not a database" * 100)
+
+    with pytest.warns(UserWarning, match="Not using the cache"):
+        res = get_citations(
+            servers,
+            ["hdl:21.14100/dataset-mpi"],
+            format=FormatOption.TEXT,
+            author_list_style=AuthorListStyle.SHORT,
+            use_cache=True,
+            cache_dir=tmp_path,
+        )
+
+    # The citations are still fetched, just without the cache
+    assert res[0].startswith("Wieners et al. (2019)")
+
+
+@pytest.mark.parametrize(
+    "ids",
+    (
+        pytest.param(["hdl:21.14100/dataset-mpi"], id="single"),
+        pytest.param(
+            ["hdl:21.14100/dataset-mpi", "hdl:21.14100/dataset-ec-earth"],
+            id="batched",
+        ),
+    ),
+)
+def test_datacite_sparse_fieldset(servers, tmp_path, ids):
+    get_citations(
+        servers,
+        ids,
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+        use_cache=True,
+        cache_dir=tmp_path,
+    )
+
+    # Only the fields needed for the citations are requested (and stored)
+    stored = Cache(tmp_path / "cache.sqlite").get("datacite:10.22033/ESGF/CMIP6.6595")
+    assert "creators" in stored["body"]
+    assert "descriptions" not in stored["body"]
+
+
+@pytest.mark.parametrize(
+    "format, host",
+    (
+        pytest.param(FormatOption.TEXT, "api.datacite.org", id="text"),
+        pytest.param(FormatOption.BIBTEX, "dx.doi.org", id="bibtex"),
+    ),
+)
+def test_stale_cache_revalidated(servers, tmp_path, monkeypatch, format, host):
+    res = []
+    for _ in range(2):
+        cmipcite.citations._HANDLE_RECORDS.clear()
+        cmipcite.citations._DOI_VERSIONS.clear()
+        res.append(
+            get_citations(
+                servers,
+                ["hdl:21.14100/dataset-mpi"],
+                format=format,
+                author_list_style=AuthorListStyle.SHORT,
+                use_cache=True,
+                cache_dir=tmp_path,
+                cache_ttl=10.0,
+            )
+        )
+
+        # Make everything in the cache stale
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda now=now: now + 20.0)
+
+    assert res[0] == res[1]
+    # The stale response is re-used as the server says it hasn't changed
+    assert servers.requests[host] == 2
+    assert servers.not_modified[host] == 1
+
+
+def test_requests_are_concurrent():
+    servers = MockServers(latency=0.01)
+
+    get_citations(
+        servers,
+        ["hdl:21.14100/dataset-mpi", "hdl:21.14100/dataset-ec-earth"],
+        format=FormatOption.BIBTEX,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    assert servers.max_in_flight["hdl.handle.net"] == 2
+    assert servers.max_in_flight["dx.doi.org"] == 2
+
+
+def test_requests_are_concurrent_with_cache(tmp_path, monkeypatch):
+    servers = MockServers(latency=0.01)
+    writes = []
+    write = Cache._write
+
+    def record_write(self, rows):
+        writes.append(len(rows))
+        write(self, rows)
+
+    monkeypatch.setattr(Cache, "_write", record_write)
+
+    get_citations(
+        servers,
+        ["hdl:21.14100/dataset-mpi", "hdl:21.14100/dataset-ec-earth"],
+        format=FormatOption.BIBTEX,
+        author_list_style=AuthorListStyle.SHORT,
+        use_cache=True,
+        cache_dir=tmp_path,
+    )
+
+    assert servers.max_in_flight["hdl.handle.net"] == 2
+    assert servers.max_in_flight["dx.doi.org"] == 2
+    # The responses are only written at the end, all in one go
+    assert writes == [4]
+
+
+def test_tracking_id_resolution_is_concurrent():
+    servers = MockServers(latency=0.01)
+
+    get_citations(
+        servers,
+        ["hdl:21.14100/file-mpi-1", "hdl:21.14100/file-mpi-2"],
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    # Both tracking IDs are looked up at once, rather than one after the other
+    assert servers.max_in_flight["hdl.handle.net"] == 2
+
+
+def test_datacite_requests_are_batched(servers):
+    res = get_citations(
+        servers,
+        ["hdl:21.14100/dataset-mpi", "hdl:21.14100/dataset-ec-earth"],
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    assert [c.split(" (2019)")[0] for c in res] == [
+        "Wieners et al.",
+        "EC-Earth Consortium (EC-Earth)",
+    ]
+    # Both DOIs were resolved at the same time, so are queried together
+    assert servers.requests["api.datacite.org"] == 1
+
+
+def test_datacite_requests_are_batched_with_jitter(monkeypatch):
+    ids = []
+    for i in range(20):
+        doi = f"10.22033/esgf/cmip6.{i}"
+        monkeypatch.setitem(
+            HANDLES,
+            f"21.14100/dataset-{i}",
+            {
+                "AGGREGATION_LEVEL": "DATASET",
+                "IS_PART_OF": f"doi:{doi}",
+                "VERSION_NUMBER": "20200101",
+            },
+        )
+        monkeypatch.setitem(
+            DATACITE, doi, {**DATACITE["10.22033/esgf/cmip6.4700"], "doi": doi}
+        )
+        # Tracking IDs, so that the DOIs are known after a varying number of hops
+        ids.append(f"hdl:21.14100/dataset-{i}" if i % 2 else f"hdl:21.14100/file-{i}")
+        monkeypatch.setitem(
+            HANDLES,
+            f"21.14100/file-{i}",
+            {"AGGREGATION_LEVEL": "FILE", "IS_PART_OF": f"hdl:21.14100/dataset-{i}"},
+        )
+
+    servers = MockServers(latency=0.02, jitter=0.04)
+    res = get_citations(
+        servers,
+        ids,
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    assert len(res) == len(ids)
+    # Rather than a request (nearly) every time a handle response arrives
+    assert servers.requests["api.datacite.org"] == 1
+
+
+def test_datacite_single_doi_batch_has_etag(servers, tmp_path):
+    get_citations(
+        servers,
+        ["hdl:21.14100/file-mpi-1", "hdl:21.14100/file-mpi-2"],
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+        use_cache=True,
+        cache_dir=tmp_path,
+    )
+
+    # Fetched from the DOI's own endpoint rather than searched for,
+    # so the cached metadata can be revalidated once stale
+    cached = Cache(tmp_path / "cache.sqlite").get("datacite:10.22033/ESGF/CMIP6.6595")
+    assert cached["etag"] is not None
+    assert servers.requests["api.datacite.org"] == 1
+
+
+def test_datacite_batch_size(servers, monkeypatch):
+    monkeypatch.setattr(cmipcite.citations, "DATACITE_BATCH_SIZE", 1)
+
+    res = get_citations(
+        servers,
+        ["hdl:21.14100/dataset-mpi", "hdl:21.14100/dataset-ec-earth"],
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    assert len(res) == 2
+    assert servers.requests["api.datacite.org"] == 2
+
+
+@pytest.mark.parametrize(
+    "format, host",
+    (
+        pytest.param(FormatOption.TEXT, "api.datacite.org", id="text"),
+        pytest.param(FormatOption.BIBTEX, "dx.doi.org", id="bibtex"),
+    ),
+)
+def test_versions_share_doi_requests(servers, format, host):
+    res = get_citations(
+        servers,
+        # The tracking ID is only resolved to the other version
+        # after the first version's DOI has been requested
+        ["hdl:21.14100/dataset-mpi-v2", "hdl:21.14100/file-mpi-1"],
+        format=format,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    assert len(res) == 2
+    assert "Version 20230101." in res[0]
+    assert "Version 20211412." in res[1]
+    assert servers.requests[host] == 1
+
+
+def test_datacite_batch_paging(servers):
+    servers.datacite_max_page_size = 1
+
+    res = get_citations(
+        servers,
+        ["hdl:21.14100/dataset-mpi", "hdl:21.14100/dataset-ec-earth"],
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    assert [c.split(" (2019)")[0] for c in res] == [
+        "Wieners et al.",
+        "EC-Earth Consortium (EC-Earth)",
+    ]
+    assert servers.requests["api.datacite.org"] == 2
+
+
+def test_datacite_batch_missing_doi(servers, monkeypatch):
+    # The bulk query doesn't find this DOI, but the single DOI endpoint does
+    monkeypatch.setitem(
+        DATACITE,
+        "10.22033/esgf/cmip6.4700",
+        {**DATACITE["10.22033/esgf/cmip6.4700"], "doi": "not-indexed-yet"},
+    )
+
+    res = get_citations(
+        servers,
+        ["hdl:21.14100/dataset-mpi", "hdl:21.14100/dataset-ec-earth"],
+        format=FormatOption.TEXT,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    assert len(res) == 2
+    assert servers.requests["api.datacite.org"] == 2
+
+
+def test_datacite_batch_missing_dois_fetched_concurrently(monkeypatch):
+    servers = MockServers(latency=0.01)
+    dois = ["10.22033/esgf/cmip6.6595", "10.22033/esgf/cmip6.4700"]
+    # Neither is found by the bulk query
+    for doi in dois:
+        monkeypatch.setitem(DATACITE, doi, {**DATACITE[doi], "doi": "not-indexed-yet"})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(servers)) as client:
+            batcher = cmipcite.citations._DataCiteBatcher(client, cache=None)
+            futures = [batcher.get(doi) for doi in [*dois, "10.22033/unknown"]]
+
+            return await asyncio.gather(*futures, return_exceptions=True)
+
+    res = asyncio.run(run())
+
+    # The DOI which DataCite doesn't know only fails its own request
+    assert [r["titles"] for r in res[:2]] == [DATACITE[doi]["titles"] for doi in dois]
+    assert isinstance(res[2], httpx.HTTPStatusError)
+    # One search, then the three missing DOIs at once
+    assert servers.requests["api.datacite.org"] == 4
+    assert servers.max_in_flight["api.datacite.org"] == 3
+
+
+def test_requests_are_pipelined():
+    servers = MockServers(latency=0.01)
+
+    get_citations(
+        servers,
+        ["hdl:21.14100/file-mpi-1", "hdl:21.14100/dataset-ec-earth"],
+        format=FormatOption.BIBTEX,
+        author_list_style=AuthorListStyle.SHORT,
+    )
+
+    # The citation for the dataset PID is requested
+    # while the tracking ID is still being resolved
+    # (only for bibtex, DataCite's requests wait to be batched)
+    first_bibtex_start = servers.events.index(("start", "dx.doi.org"))
+    last_handle_end = len(servers.events) - servers.events[::-1].index(
+        ("end", "hdl.handle.net")
+    )
+    assert first_bibtex_start < last_handle_end
+
+
+def test_unknown_aggregation_level(servers, monkeypatch):
+    monkeypatch.setitem(
+        HANDLES, "21.14100/collection", {"AGGREGATION_LEVEL": "COLLECTION"}
+    )
+
+    with pytest.raises(NotImplementedError, match="unknown AGGREGATION_LEVEL"):
+        get_citations(
+            servers,
+            ["hdl:21.14100/collection"],
+            format=FormatOption.TEXT,
+            author_list_style=AuthorListStyle.SHORT,
+        )
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    (
+        pytest.param({"max_concurrent": 0}, id="max_concurrent"),
+        pytest.param({"max_per_second": 0.0}, id="max_per_second"),
+    ),
+)
+def test_invalid_limits(servers, kwargs):
+    with pytest.raises(ValueError, match="max_"):
+        get_citations(
+            servers,
+            ["hdl:21.14100/dataset-mpi"],
+            format=FormatOption.TEXT,
+            author_list_style=AuthorListStyle.SHORT,
+            **kwargs,
+        )
+
+    assert not servers.requests
+
+
+def test_client_left_open(servers):
+    async def run():
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(servers), follow_redirects=True
+        ) as client:
+            for input_id in [
+                "hdl:21.14100/dataset-mpi",
+                "hdl:21.14100/dataset-ec-earth",
+            ]:
+                await get_citations_async(
+                    [input_id],
+                    format=FormatOption.TEXT,
+                    author_list_style=AuthorListStyle.SHORT,
+                    use_cache=False,
+                    client=client,
+                )
+
+            # The caller's client is re-used between calls, not closed by them
+            return client.is_closed
+
+    assert not asyncio.run(run())
+    assert servers.requests["api.datacite.org"] == 2
+
+
+@pytest.mark.parametrize("max_concurrent", (5, 20))
+def test_client_pool_fits_max_concurrent(monkeypatch, max_concurrent):
+    limits = []
+    transport = httpx.AsyncHTTPTransport
+
+    def record_limits(**kwargs):
+        limits.append(kwargs["limits"])
+        return transport(**kwargs)
+
+    monkeypatch.setattr(httpx, "AsyncHTTPTransport", record_limits)
+
+    async def run():
+        async with cmipcite.citations.create_client(max_concurrent=max_concurrent):
+            pass
+
+    asyncio.run(run())
+
+    # Room for `max_concurrent` requests to each of the three servers at once
+    assert limits
+    assert all(
+        limit.max_connections == limit.max_keepalive_connections == 3 * max_concurrent
+        for limit in limits
+    )
+
+
+def test_client_uses_environment_proxy(monkeypatch):
+    for name in ("HTTP_PROXY", "HTTPS_PROXY", "ALL_PROXY", "NO_PROXY"):
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.lower(), raising=False)
+
+    connects = []
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handle_connection(reader, writer):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            connects.append((await reader.readline()).decode().split()[:2])
+            while (await reader.readline()).strip():
+                pass
+
+            await asyncio.sleep(0.01)
+            # Refuse the tunnel, so no request leaves the machine
+            writer.write(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+        finally:
+            in_flight -= 1
+            writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        monkeypatch.setenv("HTTPS_PROXY", f"http://127.0.0.1:{port}")
+        async with server, cmipcite.citations.create_client(max_concurrent=1) as client:
+            return await asyncio.gather(
+                *(client.get("https://api.datacite.org/dois") for _ in range(3)),
+                return_exceptions=True,
+            )
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, httpx.ProxyError) for result in results)
+    assert connects == [["CONNECT", "api.datacite.org:443"]] * 3
+    # The proxied requests are still throttled
+    assert max_in_flight == 1
+
+
+def test_environment_no_proxy(monkeypatch):
+    monkeypatch.setenv("HTTPS_PROXY", "proxy.example.org:3128")
+    monkeypatch.setenv("NO_PROXY", "localhost, .example.org,::1")
+    for name in ("HTTP_PROXY", "ALL_PROXY"):
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.lower(), raising=False)
+    for name in ("https_proxy", "no_proxy"):
+        monkeypatch.delenv(name, raising=False)
+
+    assert cmipcite.citations._get_environment_proxies() == {
+        "https://": "http://proxy.example.org:3128",
+        "all://localhost": None,
+        "all://*.example.org": None,
+        "all://[::1]": None,
+    }
@@ -0,0 +1,170 @@
+"""
+Tests of `cmipcite.throttling`
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter
+
+import httpx
+import pytest
+
+from cmipcite.throttling import RateLimiter, ThrottledTransport
+
+
+def send_requests(transport, n, hosts=("api.datacite.org",)):
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await asyncio.gather(
+                *[client.get(f"https://{host}/{i}") for i in range(n) for host in hosts]
+            )
+
+    return asyncio.run(run())
+
+
+def test_rate_limiter_burst_then_spread():
+    async def run():
+        limiter = RateLimiter(max_per_second=20.0)
+        start = time.monotonic()
+        for _ in range(30):
+            await limiter.acquire()
+
+        return time.monotonic() - start
+
+    # The first 20 go straight through, the other 10 at 20 per second
+    assert 0.45 < asyncio.run(run()) < 1.0
+
+
+def test_rate_limiter_fractional_rate():
+    async def run():
+        limiter = RateLimiter(max_per_second=0.9)
+        start = time.monotonic()
+        for _ in range(2):
+            await limiter.acquire()
+
+        return time.monotonic() - start
+
+    # The first goes straight through, the second once a whole token has refilled
+    assert 1.05 < asyncio.run(run()) < 1.5
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    (
+        pytest.param({"max_concurrent": 0}, id="max_concurrent"),
+        pytest.param({"max_per_second": 0.0}, id="max_per_second"),
+        pytest.param({"max_per_second": -1.0}, id="max_per_second-negative"),
+    ),
+)
+def test_invalid_limits(kwargs):
+    with pytest.raises(ValueError, match="max_"):
+        ThrottledTransport(httpx.MockTransport(lambda request: None), **kwargs)
+
+
+def test_max_concurrent():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+        return httpx.Response(200)
+
+    transport = ThrottledTransport(
+        httpx.MockTransport(handler), max_concurrent=3, max_per_second=1000.0
+    )
+    send_requests(transport, 10)
+
+    assert max_in_flight == 3
+
+
+def test_max_concurrent_per_host():
+    in_flight = Counter()
+    max_in_flight = Counter()
+
+    async def handler(request):
+        host = request.url.host
+        in_flight[host] += 1
+        max_in_flight[host] = max(max_in_flight[host], in_flight[host])
+        await asyncio.sleep(0.01)
+        in_flight[host] -= 1
+
+        return httpx.Response(200)
+
+    transport = ThrottledTransport(
+        httpx.MockTransport(handler), max_concurrent=3, max_per_second=1000.0
+    )
+    send_requests(transport, 10, hosts=("api.datacite.org", "hdl.handle.net"))
+
+    assert max_in_flight == {"api.datacite.org": 3, "hdl.handle.net": 3}
+
+
+@pytest.mark.parametrize("status_code", (429, 503))
+def test_retry(status_code):
+    responses = [
+        httpx.Response(status_code, headers={"Retry-After": "0"}),
+        httpx.Response(status_code),
+        httpx.Response(200),
+    ]
+
+    transport = ThrottledTransport(
+        httpx.MockTransport(lambda request: responses.pop(0)), backoff_factor=0.0
+    )
+    res = send_requests(transport, 1)
+
+    assert res[0].status_code == 200
+    assert not responses
+
+
+def test_retry_gives_up():
+    n_requests = 0
+
+    def handler(request):
+        nonlocal n_requests
+        n_requests += 1
+
+        return httpx.Response(429)
+
+    transport = ThrottledTransport(
+        httpx.MockTransport(handler), max_retries=2, backoff_factor=0.0
+    )
+    res = send_requests(transport, 1)
+
+    assert res[0].status_code == 429
+    assert n_requests == 3
+
+
+def test_retry_after_too_long():
+    n_requests = 0
+
+    def handler(request):
+        nonlocal n_requests
+        n_requests += 1
+
+        return httpx.Response(429, headers={"Retry-After": "3600"})
+
+    res = send_requests(ThrottledTransport(httpx.MockTransport(handler)), 1)
+
+    assert res[0].status_code == 429
+    assert n_requests == 1
+
+
+def test_no_retry_client_error():
+    n_requests = 0
+
+    def handler(request):
+        nonlocal n_requests
+        n_requests += 1
+
+        return httpx.Response(404)
+
+    res = send_requests(ThrottledTransport(httpx.MockTransport(handler)), 1)
+
+    assert res[0].status_code == 404
+    assert n_requests == 1